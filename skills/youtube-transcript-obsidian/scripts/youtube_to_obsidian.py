@@ -1,31 +1,158 @@
 #!/usr/bin/env python3
 import argparse
+import asyncio
+import contextlib
+import functools
+import io
 import json
+import os
+import queue
 import re
+import sqlite3
 import subprocess
 import sys
 import tempfile
+import threading
+import time
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from pathlib import Path
-from shutil import which
+from shutil import rmtree, which
 
 from youtube_transcript_api import YouTubeTranscriptApi
 from youtube_transcript_api._errors import NoTranscriptFound, TranscriptsDisabled
+from yt_dlp import YoutubeDL
+from yt_dlp.utils import DownloadCancelled
+
+try:
+    import orjson
+
+    _json_loads = orjson.loads
+
+    def _json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode("utf-8")
+
+except ImportError:  # orjson is optional; stdlib json is ~2-3x slower on large metadata
+    _json_loads = json.loads
+
+    def _json_dumps(obj) -> str:
+        return json.dumps(obj, ensure_ascii=False)
+
+
+CACHE_DIR = Path("~/.cache/yt2obs").expanduser()
+META_CACHE_DIR = CACHE_DIR / "meta"
+META_CACHE_TTL = 24 * 3600
+TRANSCRIPT_CACHE_PATH = CACHE_DIR / "transcripts.sqlite3"
+PREFERRED_LANGS = ["en", "zh-CN", "zh", "zh-Hans", "zh-Hant"]
+
+WHISPER_MODEL = "base"
+WHISPER_COMPUTE_TYPE = "int8"
+ASR_SAMPLE_RATE = 16000
+MAX_ASR_SECONDS = 3600
+ASR_HEDGE_SECONDS = 20.0
+
+GEMINI_TIMEOUT = 600
+
+YT_REQUESTS_PER_SECOND = 1.0
+YT_REQUEST_BURST = 2
+BATCH_WORKERS = 8
+MAX_CONCURRENT_DOWNLOADS = 2
+
+RETRY_ATTEMPTS = 3
+RETRY_BASE_SECONDS = 2.0
+RETRY_MAX_SECONDS = 30.0
+RATE_LIMIT_ERRORS = ("TooManyRequests", "RequestBlocked", "IpBlocked")
+
+_SANITIZE_BAD = re.compile(r"[\\/:*?\"<>|]")
+_WS = re.compile(r"\s+")
+_VID_PATTERNS = [
+    re.compile(p) for p in (r"v=([A-Za-z0-9_-]{11})", r"youtu\.be/([A-Za-z0-9_-]{11})", r"/shorts/([A-Za-z0-9_-]{11})")
+]
+_VID_BARE = re.compile(r"[A-Za-z0-9_-]{11}")
+# [^\S\n] is whitespace other than newline, so a match never spans two lines
+_CHAPTER_LINE = re.compile(r"^[^\S\n]*(\d{1,2}):(\d{2})(?::(\d{2}))?[^\S\n]*[–-]?[^\S\n]*(.+?)[^\S\n]*$", re.M)
+_SENT_SPLIT = re.compile(r"(?<=[.!?。！？])\s+")
+_BRACKETED = re.compile(r"[\[(（【].*[\])）】]")
+# only multi-word phrases: messages embed video ids/URLs, which can contain "429" or "quota"
+_RATE_LIMITED = re.compile(
+    r"http error 429|429 client error|too many requests|quota exceeded|exceeded [\w ]{0,20}quota", re.I
+)
+
+
+def _is_rate_limited(exc: Exception) -> bool:
+    if type(exc).__name__ in RATE_LIMIT_ERRORS:
+        return True
+    return _RATE_LIMITED.search(str(exc)) is not None
 
 
-def hms(seconds: float) -> str:
-    s = int(max(0, seconds))
-    h = s // 3600
-    m = (s % 3600) // 60
-    sec = s % 60
+class RateLimiter:
+    """Token bucket shared by every thread that sends requests to YouTube."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# burst of 2 lets a single video fetch metadata and subtitles at the same time
+_YT_LIMITER = RateLimiter(YT_REQUESTS_PER_SECOND, YT_REQUEST_BURST)
+
+# caps simultaneous audio downloads across batch workers; held per video so that
+# waiting for a slot never counts towards the cookie-attempt hedge timer
+_DOWNLOAD_SLOTS = threading.BoundedSemaphore(MAX_CONCURRENT_DOWNLOADS)
+
+# ASR is CPU bound; batch workers take turns instead of oversubscribing the cores
+_ASR_LOCK = threading.Lock()
+
+
+def retry_rate_limited(fn):
+    """Retry fn with exponential backoff while YouTube is throttling us."""
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        for attempt in range(1, RETRY_ATTEMPTS + 1):
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if attempt == RETRY_ATTEMPTS or not _is_rate_limited(e):
+                    raise
+                delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (attempt - 1))
+                print(f"WARN: rate limited by YouTube, retrying in {delay:.0f}s ({attempt}/{RETRY_ATTEMPTS - 1})")
+                time.sleep(delay)
+
+    return wrapper
+
+
+@functools.lru_cache(maxsize=4096)
+def _hms_int(s: int) -> str:
+    m, sec = divmod(s, 60)
+    h, m = divmod(m, 60)
     return f"[{h:02d}:{m:02d}:{sec:02d}]"
 
 
-def seconds_text(seconds: float) -> str:
-    s = int(max(0, seconds or 0))
-    h = s // 3600
-    m = (s % 3600) // 60
-    sec = s % 60
+def hms(seconds: float) -> str:
+    return _hms_int(int(max(0, seconds)))
+
+
+@functools.lru_cache(maxsize=4096)
+def _seconds_text_int(s: int) -> str:
+    m, sec = divmod(s, 60)
+    h, m = divmod(m, 60)
     if h:
         return f"{h}h {m}m {sec}s"
     if m:
@@ -33,32 +160,73 @@ def seconds_text(seconds: float) -> str:
     return f"{sec}s"
 
 
+def seconds_text(seconds: float) -> str:
+    return _seconds_text_int(int(max(0, seconds or 0)))
+
+
+# read once at import, while still single-threaded (os.umask can only be read by setting it)
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+@contextlib.contextmanager
+def atomic_open(path: Path):
+    """Write to a hidden sibling temp file and os.replace it onto path once complete."""
+    # the temp name must not embed path.name: a title near NAME_MAX would overflow it
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".", suffix=".tmp")
+    try:
+        # mkstemp creates 0600; give the note the same mode a plain open() would
+        os.fchmod(fd, 0o666 & ~_UMASK)
+        with os.fdopen(fd, "w", encoding="utf-8") as fp:
+            yield fp
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
 def sanitize(name: str) -> str:
-    name = re.sub(r"[\\/:*?\"<>|]", "-", name)
-    return re.sub(r"\s+", " ", name).strip()[:140]
+    name = _SANITIZE_BAD.sub("-", name)
+    return _WS.sub(" ", name).strip()[:140]
 
 
 def video_id_from_url(url: str) -> str:
-    patterns = [r"v=([A-Za-z0-9_-]{11})", r"youtu\.be/([A-Za-z0-9_-]{11})", r"/shorts/([A-Za-z0-9_-]{11})"]
-    for p in patterns:
-        m = re.search(p, url)
+    for p in _VID_PATTERNS:
+        m = p.search(url)
         if m:
             return m.group(1)
-    if re.fullmatch(r"[A-Za-z0-9_-]{11}", url):
+    if _VID_BARE.fullmatch(url):
         return url
     raise ValueError("Cannot parse YouTube video id")
 
 
-def get_metadata(url: str) -> dict:
-    proc = subprocess.run(
-        [sys.executable, "-m", "yt_dlp", "--dump-single-json", "--no-playlist", url],
-        capture_output=True,
-        text=True,
-        check=True,
-    )
-    return json.loads(proc.stdout)
+@retry_rate_limited
+def _fetch_metadata(url: str) -> dict:
+    _YT_LIMITER.acquire()
+    with YoutubeDL({"quiet": True, "no_warnings": True, "skip_download": True, "noplaylist": True}) as ydl:
+        return ydl.sanitize_info(ydl.extract_info(url, download=False))
+
 
+def get_metadata(url: str, use_cache: bool = True, refresh: bool = False) -> dict:
+    # yt-dlp metadata is cached on disk per video id for META_CACHE_TTL seconds
+    vid = video_id_from_url(url)
+    cache_file = META_CACHE_DIR / f"{vid}.json"
+    if use_cache and not refresh and cache_file.exists():
+        if time.time() - cache_file.stat().st_mtime < META_CACHE_TTL:
+            try:
+                return _json_loads(cache_file.read_bytes())
+            except ValueError:
+                pass
 
+    meta = _fetch_metadata(url)
+    if use_cache:
+        META_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        with atomic_open(cache_file) as fp:
+            fp.write(_json_dumps(meta))
+    return meta
+
+
+@functools.lru_cache(maxsize=None)
 def get_ffmpeg_exe() -> str:
     exe = which("ffmpeg")
     if exe:
@@ -71,159 +239,237 @@ def get_ffmpeg_exe() -> str:
         return ""
 
 
-def asr_fallback(video_url: str):
-    ffmpeg_exe = get_ffmpeg_exe()
-    if not ffmpeg_exe:
-        raise RuntimeError("ffmpeg not found; cannot run ASR fallback")
+def race_downloads(video_url: str, attempts: list):
+    """Download video_url trying each yt-dlp option set in order, hedging stalled starts.
 
-    env = dict(**__import__("os").environ)
+    attempts[0] runs alone first. The next attempt is started only when every
+    running one has failed, or when none has begun downloading within
+    ASR_HEDGE_SECONDS (e.g. stuck during extraction). The first success wins;
+    the others are abandoned (daemon threads) rather than waited for, and
+    stop at their next check: after the rate limiter, after extraction, or
+    in their progress hook.
 
-    with tempfile.TemporaryDirectory(prefix="yt-asr-") as tmp:
-        # whisper expects executable name `ffmpeg`; imageio ships versioned filename
-        ffmpeg_link = Path(tmp) / "ffmpeg"
+    Returns (index of the first attempt that succeeded or None, last error).
+    """
+    done = threading.Event()
+    progressed = threading.Event()
+    finished = queue.Queue()
+
+    def hook(_status):
+        if done.is_set():
+            raise DownloadCancelled()
+        progressed.set()
+
+    def run(i, opts):
         try:
-            ffmpeg_link.symlink_to(Path(ffmpeg_exe))
-        except Exception:
-            pass
-        env["PATH"] = str(Path(tmp)) + ":" + env.get("PATH", "")
-        env["IMAGEIO_FFMPEG_EXE"] = ffmpeg_exe
-
-        audio_path = f"{tmp}/audio.%(ext)s"
-        ytdlp_attempts = [
-            [
-                sys.executable,
-                "-m",
-                "yt_dlp",
-                "-q",
-                "--extractor-args",
-                "youtube:player_client=android",
-                "-f",
-                "bestaudio/best",
-                "-o",
-                audio_path,
-                video_url,
-            ],
-            [
-                sys.executable,
-                "-m",
-                "yt_dlp",
-                "-q",
-                "--cookies-from-browser",
-                "chrome",
-                "--extractor-args",
-                "youtube:player_client=android",
-                "-f",
-                "bestaudio/best",
-                "-o",
-                audio_path,
-                video_url,
-            ],
-            [
-                sys.executable,
-                "-m",
-                "yt_dlp",
-                "-q",
-                "--cookies-from-browser",
-                "safari",
-                "--extractor-args",
-                "youtube:player_client=android",
-                "-f",
-                "bestaudio/best",
-                "-o",
-                audio_path,
-                video_url,
-            ],
-        ]
-
-        last_err = None
-        for cmd in ytdlp_attempts:
+            # audio downloads share the YouTube request budget with metadata/subtitle calls
+            _YT_LIMITER.acquire()
+            # a loser must stop before YoutubeDL touches browser cookies or the temp dir
+            if done.is_set():
+                return
+            with YoutubeDL({**opts, "progress_hooks": [hook]}) as ydl:
+                info = ydl.extract_info(video_url, download=False)
+                if done.is_set():
+                    return
+                # failures raise DownloadError, so reaching put() means the download succeeded
+                ydl.process_ie_result(info, download=True)
+                finished.put((i, 0, None))
+        except Exception as e:
+            finished.put((i, 1, e))
+
+    winner = None
+    last_err = None
+    started = running = 0
+    try:
+        while winner is None:
+            if running == 0:
+                if started == len(attempts):
+                    break
+                threading.Thread(target=run, args=(started, attempts[started]), daemon=True).start()
+                started += 1
+                running += 1
+            hedge = started < len(attempts) and not progressed.is_set()
             try:
-                subprocess.run(cmd, check=True, env=env)
-                last_err = None
-                break
-            except subprocess.CalledProcessError as e:
-                last_err = e
+                i, retcode, err = finished.get(timeout=ASR_HEDGE_SECONDS if hedge else None)
+            except queue.Empty:
+                if progressed.is_set():
+                    continue
+                threading.Thread(target=run, args=(started, attempts[started]), daemon=True).start()
+                started += 1
+                running += 1
+                continue
+            running -= 1
+            if err is None and retcode == 0:
+                winner = i
+            else:
+                last_err = err or last_err
+    finally:
+        done.set()
+    return winner, last_err
 
-        if last_err is not None:
+
+@functools.lru_cache(maxsize=None)
+def get_whisper_model():
+    # loaded once per process; faster-whisper is only needed on the ASR path
+    from faster_whisper import WhisperModel
+
+    return WhisperModel(WHISPER_MODEL, device="auto", compute_type=WHISPER_COMPUTE_TYPE)
+
+
+def asr_fallback(video_url: str):
+    # Whisper works on 16kHz mono anyway; converting up front keeps the file small and
+    # skips the resample during decoding. Without ffmpeg the raw stream is used as-is.
+    ffmpeg_exe = get_ffmpeg_exe()
+    convert_opts = {}
+    if ffmpeg_exe:
+        convert_opts = {
+            "ffmpeg_location": ffmpeg_exe,
+            "postprocessors": [{"key": "FFmpegExtractAudio", "preferredcodec": "wav"}],
+            "postprocessor_args": {"extractaudio": ["-ar", str(ASR_SAMPLE_RATE), "-ac", "1"]},
+        }
+
+    # removed by hand: an abandoned download attempt may still be writing into it
+    tmp = tempfile.mkdtemp(prefix="yt-asr-")
+    try:
+        # each attempt downloads into its own directory so racing outputs never collide;
+        # browser cookies are only read once the anonymous attempt fails or stalls
+        cookie_browsers = [None, "chrome", "safari"]
+        attempt_dirs = [Path(tmp) / f"attempt-{i}" for i in range(len(cookie_browsers))]
+        ytdlp_attempts = []
+        for browser, attempt_dir in zip(cookie_browsers, attempt_dirs):
+            opts = {
+                "quiet": True,
+                "noplaylist": True,
+                "format": "bestaudio/best",
+                "outtmpl": f"{attempt_dir}/audio.%(ext)s",
+                "extractor_args": {"youtube": {"player_client": ["android"]}},
+                **convert_opts,
+            }
+            if browser:
+                opts["cookiesfrombrowser"] = (browser,)
+            ytdlp_attempts.append(opts)
+
+        with _DOWNLOAD_SLOTS:
+            winner, last_err = race_downloads(video_url, ytdlp_attempts)
+        if winner is None:
             raise RuntimeError("yt-dlp could not download audio (403/cookies issue)") from last_err
 
-        audio_file = next(Path(tmp).glob("audio.*"), None)
+        audio_file = next(attempt_dirs[winner].glob("audio.*"), None)
         if audio_file is None:
             raise RuntimeError("failed to download audio for ASR")
 
-        whisper_cmds = [
-            [
-                sys.executable,
-                "-m",
-                "whisper",
-                str(audio_file),
-                "--model",
-                "tiny",
-                "--task",
-                "transcribe",
-                "--output_format",
-                "json",
-                "--output_dir",
-                tmp,
-            ],
-            [
-                sys.executable,
-                "-m",
-                "whisper",
-                str(audio_file),
-                "--model",
-                "base",
-                "--task",
-                "transcribe",
-                "--output_format",
-                "json",
-                "--output_dir",
-                tmp,
-            ],
-        ]
-        whisper_ok = False
-        for wcmd in whisper_cmds:
-            try:
-                subprocess.run(wcmd, check=True, env=env)
-                whisper_ok = True
-                break
-            except subprocess.CalledProcessError:
-                continue
-
-        json_candidates = sorted(Path(tmp).glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True)
-        json_out = json_candidates[0] if json_candidates else None
-        if not whisper_ok or json_out is None:
-            raise RuntimeError("whisper did not produce json output")
-
-        data = json.loads(json_out.read_text(encoding="utf-8"))
-        segs = data.get("segments") or []
         entries = []
-        for s in segs:
-            text = (s.get("text") or "").strip()
-            if not text:
-                continue
-            entries.append({"start": float(s.get("start") or 0.0), "text": text})
+        with _ASR_LOCK:
+            # segments is a lazy generator; decoding happens while iterating it
+            segments, _info = get_whisper_model().transcribe(str(audio_file), task="transcribe")
+            for seg in segments:
+                text = (seg.text or "").strip()
+                if not text:
+                    continue
+                entries.append({"start": float(seg.start or 0.0), "text": text})
         return entries
+    finally:
+        rmtree(tmp, ignore_errors=True)
+
+
+class TranscriptCache:
+    """Transcript entries stored in SQLite, keyed by (video_id, lang, source)."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # one connection shared by all worker threads, serialized by self.lock
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.lock = threading.Lock()
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS transcripts ("
+            "video_id TEXT, lang TEXT, source TEXT, json TEXT, ts INTEGER, "
+            "PRIMARY KEY (video_id, lang, source))"
+        )
+        self.conn.commit()
+
+    def get(self, video_id: str, source: str, langs: list = None):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT lang, json FROM transcripts WHERE video_id = ? AND source = ?",
+                (video_id, source),
+            ).fetchall()
+        if not rows:
+            return None
+        by_lang = dict(rows)
+        if langs:
+            hit = next((by_lang[lang] for lang in langs if lang in by_lang), None)
+        else:
+            hit = rows[0][1]
+        return _json_loads(hit) if hit is not None else None
+
+    def put(self, video_id: str, lang: str, source: str, entries: list):
+        payload = _json_dumps(entries)
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO transcripts (video_id, lang, source, json, ts) VALUES (?, ?, ?, ?, ?)",
+                (video_id, lang, source, payload, int(time.time())),
+            )
+            self.conn.commit()
+
+
+@retry_rate_limited
+def _fetch_subtitles(video_id: str):
+    _YT_LIMITER.acquire()
+    return YouTubeTranscriptApi().fetch(video_id, languages=PREFERRED_LANGS)
 
 
-def get_transcript(video_id: str, video_url: str, force_asr: bool = False):
+def check_asr_allowed(meta: dict, max_asr_seconds: int):
+    duration = meta.get("duration") or 0
+    if max_asr_seconds and duration > max_asr_seconds:
+        raise RuntimeError(
+            f"no subtitles and video is {seconds_text(duration)} long; "
+            f"ASR fallback is limited to {seconds_text(max_asr_seconds)} "
+            "(raise --max-asr-seconds, or pass --force-asr to transcribe anyway)"
+        )
+    if "Music" in (meta.get("categories") or []):
+        raise RuntimeError(
+            "no subtitles and video is categorized as Music; skipping ASR fallback "
+            "(pass --force-asr to transcribe anyway)"
+        )
+
+
+def get_asr_transcript(video_id: str, video_url: str, cache: TranscriptCache = None, check=None):
+    """Return (entries, "asr-fallback"), reusing a cached ASR run before calling check() and Whisper."""
+    if cache is not None:
+        entries = cache.get(video_id, "asr-fallback")
+        if entries is not None:
+            return entries, "asr-fallback"
+    if check is not None:
+        check()
+    entries = [e for e in asr_fallback(video_url) if e["text"]]
+    if cache is not None:
+        cache.put(video_id, "auto", "asr-fallback", entries)
+    return entries, "asr-fallback"
+
+
+def get_transcript(video_id: str, force_asr: bool = False, cache: TranscriptCache = None):
+    """Return (entries, source) from the cache or YouTube subtitles, or None when ASR is needed."""
     if force_asr:
-        entries = asr_fallback(video_url)
-        return [e for e in entries if e["text"]], "asr-fallback"
+        return None
 
-    api = YouTubeTranscriptApi()
-    preferred = ["en", "zh-CN", "zh", "zh-Hans", "zh-Hant"]
-    fetched = None
+    # only subtitles here: a cached ASR run must not hide subtitles YouTube now has
+    if cache is not None:
+        entries = cache.get(video_id, "youtube-subtitles", PREFERRED_LANGS)
+        if entries is not None:
+            return entries, "youtube-subtitles"
 
     try:
-        fetched = api.fetch(video_id, languages=preferred)
-        entries = []
-        for item in fetched:
-            entries.append({"start": float(item.start), "text": (item.text or "").strip()})
-        return [e for e in entries if e["text"]], "youtube-subtitles"
+        fetched = _fetch_subtitles(video_id)
     except (NoTranscriptFound, TranscriptsDisabled):
-        entries = asr_fallback(video_url)
-        return [e for e in entries if e["text"]], "asr-fallback"
+        return None
+    entries = []
+    for item in fetched:
+        entries.append({"start": float(item.start), "text": (item.text or "").strip()})
+    entries = [e for e in entries if e["text"]]
+    if cache is not None:
+        cache.put(video_id, getattr(fetched, "language_code", "") or "", "youtube-subtitles", entries)
+    return entries, "youtube-subtitles"
 
 
 def build_chapters(meta: dict):
@@ -233,10 +479,7 @@ def build_chapters(meta: dict):
 
     desc = (meta.get("description") or "")
     parsed = []
-    for line in desc.splitlines():
-        m = re.match(r"^\s*(\d{1,2}):(\d{2})(?::(\d{2}))?\s*[–-]?\s*(.+?)\s*$", line)
-        if not m:
-            continue
+    for m in _CHAPTER_LINE.finditer(desc):
         if m.group(3) is None:
             mm, ss = int(m.group(1)), int(m.group(2))
             start = mm * 60 + ss
@@ -247,29 +490,13 @@ def build_chapters(meta: dict):
         if title:
             parsed.append({"start": float(start), "title": title})
     if parsed:
-        return parsed
+        return sorted(parsed, key=lambda c: c["start"])
 
     return [{"start": 0.0, "title": "Transcript"}]
 
 
-def chapter_for(ts: float, chapters: list) -> int:
-    idx = 0
-    for i, c in enumerate(chapters):
-        if ts >= c["start"]:
-            idx = i
-        else:
-            break
-    return idx
-
-
-def clean_multiline(text: str) -> str:
-    text = (text or "").replace("\r\n", "\n").strip()
-    text = re.sub(r"\n{3,}", "\n\n", text)
-    return text
-
-
 def sentence_count(text: str) -> int:
-    parts = re.split(r"(?<=[.!?。！？])\s+", text.strip())
+    parts = _SENT_SPLIT.split(text.strip())
     parts = [p for p in parts if p.strip()]
     return max(1, len(parts))
 
@@ -278,7 +505,7 @@ def is_non_speech(text: str) -> bool:
     t = text.strip()
     if not t:
         return False
-    if re.fullmatch(r"[\[(（【].*[\])）】]", t):
+    if _BRACKETED.fullmatch(t):
         return True
     low = t.lower()
     markers = ["laughter", "music", "applause", "laughs", "[音乐", "[笑", "（笑", "【音乐", "【笑"]
@@ -286,14 +513,38 @@ def is_non_speech(text: str) -> bool:
 
 
 def clean_caption_text(text: str) -> str:
-    t = text.strip()
-    t = re.sub(r"^>+\s*", "", t)
-    t = re.sub(r"\s+", " ", t)
-    t = t.replace("[", "").replace("]", "")
-    return t.strip()
+    # split()/join strips ends and collapses all whitespace, newlines included
+    t = text.lstrip().lstrip(">").replace("[", "").replace("]", "")
+    return " ".join(t.split())
+
+
+class LineWriter:
+    """Stream lines to fp as if they were "\n".join-ed, with trailing whitespace stripped.
+
+    Whitespace after the last non-blank text is held back until more text
+    arrives, so the file never ends in a run of blank lines.
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.started = False
+        self.pending = ""
+
+    def append(self, line: str):
+        text = ("\n" if self.started else "") + line
+        self.started = True
+        body = text.rstrip()
+        if body:
+            self.fp.write(self.pending + body)
+            self.pending = text[len(body):]
+        else:
+            self.pending += text
 
+    def finish(self):
+        self.fp.write("\n")
 
-def flush_paragraph(out: list, speaker: str, buf: list, last_ts: float, labeled: bool) -> bool:
+
+def flush_paragraph(out: LineWriter, speaker: str, buf: list, last_ts: float, labeled: bool) -> bool:
     if not buf:
         return labeled
     text = " ".join(buf).strip()
@@ -307,36 +558,24 @@ def flush_paragraph(out: list, speaker: str, buf: list, last_ts: float, labeled:
     return labeled
 
 
-def render(meta: dict, chapters: list, transcript: list, source_url: str, vid: str, prompt_path: str) -> str:
+def render(meta: dict, chapters: list, transcript: list, source_url: str, vid: str, prompt_path: str, fp) -> None:
     title = (meta.get("title") or "YouTube Transcript").strip()
-    grouped = {i: [] for i in range(len(chapters))}
+    # rows before the first chapter start belong to the first chapter
+    starts = [c["start"] for c in chapters]
+    grouped = [[] for _ in chapters]
     for row in transcript:
-        grouped[chapter_for(row["start"], chapters)].append(row)
+        grouped[max(0, bisect_right(starts, row["start"]) - 1)].append(row)
 
     uploader = meta.get("uploader") or meta.get("channel") or ""
-    channel_url = meta.get("channel_url") or ""
-    webpage_url = meta.get("webpage_url") or source_url
-    upload_date = meta.get("upload_date") or ""
-    published = ""
-    if len(upload_date) == 8 and upload_date.isdigit():
-        published = f"{upload_date[0:4]}-{upload_date[4:6]}-{upload_date[6:8]}"
-    description = clean_multiline(meta.get("description") or "")
-    thumbnail = meta.get("thumbnail") or ""
-    duration = meta.get("duration") or 0
 
-    out = []
-    out.append(title)
-    out.append("")
-    out.append("Table of Contents")
-    out.append("")
-    for c in chapters:
-        out.append(f"* {hms(c['start'])} {c['title']}")
-
-    out.append("")
+    out = LineWriter(fp)
+    # static header (title + table of contents) goes out as a single block
+    toc = "\n".join(f"* {hms(c['start'])} {c['title']}" for c in chapters)
+    out.append(f"{title}\n\nTable of Contents\n\n{toc}\n")
     for i, c in enumerate(chapters):
         out.append(f"{hms(c['start'])} {c['title']}")
         out.append("")
-        rows = grouped.get(i, [])
+        rows = grouped[i]
         if not rows:
             out.append(f"[No transcript in this chapter] {hms(c['start'])}\n")
             out.append("")
@@ -349,7 +588,7 @@ def render(meta: dict, chapters: list, transcript: list, source_url: str, vid: s
         last_ts = c["start"]
 
         for r in rows:
-            text = clean_caption_text(r["text"].replace("\n", " "))
+            text = clean_caption_text(r["text"])
             if not text:
                 continue
 
@@ -374,13 +613,19 @@ def render(meta: dict, chapters: list, transcript: list, source_url: str, vid: s
         labeled = flush_paragraph(out, speaker, buf, last_ts, labeled)
         out.append("")
 
-    return "\n".join(out).rstrip() + "\n"
+    out.finish()
+
+
+def render_to_string(meta: dict, chapters: list, transcript: list, source_url: str, vid: str, prompt_path: str) -> str:
+    buf = io.StringIO()
+    render(meta, chapters, transcript, source_url, vid, prompt_path, buf)
+    return buf.getvalue()
 
 
 def transcript_as_lines(transcript: list) -> str:
     lines = []
     for r in transcript:
-        text = clean_caption_text((r.get("text") or "").replace("\n", " "))
+        text = clean_caption_text(r.get("text") or "")
         if not text:
             continue
         lines.append(f"{hms(float(r.get('start', 0)))} {text}")
@@ -431,11 +676,14 @@ Hard constraints:
 5) Follow Dialogue Paragraphs rule in the spec exactly.
 """.strip()
 
+    # the prompt embeds the whole transcript; pipe it via stdin rather than argv (ARG_MAX)
     cmd = ["gemini"]
     if gemini_model:
         cmd += ["--model", gemini_model]
-    cmd += [instruction]
-    proc = subprocess.run(cmd, capture_output=True, text=True)
+    try:
+        proc = subprocess.run(cmd, input=instruction, capture_output=True, text=True, timeout=GEMINI_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        raise RuntimeError(f"gemini timed out after {GEMINI_TIMEOUT}s") from None
     if proc.returncode != 0:
         raise RuntimeError(proc.stderr.strip() or "gemini command failed")
     output = (proc.stdout or "").strip()
@@ -444,14 +692,74 @@ Hard constraints:
     return output + "\n"
 
 
+async def fetch_video(url: str, vid: str, args, cache: TranscriptCache = None):
+    # metadata and subtitles are independent network calls; run them side by side
+    meta, found = await asyncio.gather(
+        asyncio.to_thread(get_metadata, url, use_cache=not args.no_cache, refresh=args.refresh_metadata),
+        asyncio.to_thread(get_transcript, vid, force_asr=args.force_asr, cache=cache),
+    )
+    if found is None:
+        # ASR waits for metadata so long or music-only videos fail fast instead of hours of Whisper
+        check = None if args.force_asr else functools.partial(check_asr_allowed, meta, args.max_asr_seconds)
+        found = await asyncio.to_thread(get_asr_transcript, vid, url, cache, check)
+    return meta, found
+
+
+def process_one(url: str, args, vault: Path, prompt_text: str, cache: TranscriptCache = None) -> Path:
+    vid = video_id_from_url(url)
+    meta, (transcript, transcript_source) = asyncio.run(fetch_video(url, vid, args, cache))
+    chapters = build_chapters(meta)
+
+    # note stays None when the local renderer should stream straight into the file
+    note = None
+    if prompt_text:
+        try:
+            note = render_with_gemini(
+                meta,
+                chapters,
+                transcript,
+                url,
+                prompt_text,
+                transcript_source,
+                args.gemini_model,
+            )
+        except Exception as e:
+            print(f"WARN: gemini formatting failed, fallback to local renderer: {e}")
+
+    out_dir = vault / args.out_dir
+    out_dir.mkdir(parents=True, exist_ok=True)
+    fname = sanitize(meta.get("title") or vid)
+    out = out_dir / f"{datetime.now().strftime('%Y-%m-%d')} {fname}.md"
+    with atomic_open(out) as fp:
+        if note is None:
+            render(meta, chapters, transcript, url, vid, args.prompt, fp)
+        else:
+            fp.write(note.rstrip() + "\n")
+        fp.write(
+            f"\n---\ntranscription_method: {transcript_source}\n"
+            f"restructure_model: {args.gemini_model if prompt_text else 'local-renderer'}\n"
+        )
+    return out
+
+
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--url", required=True)
+    ap.add_argument("--url", action="append", required=True, help="YouTube URL or video id; repeat for a batch")
     ap.add_argument("--vault", required=True)
     ap.add_argument("--out-dir", default="Inbox/YouTube Transcripts")
     ap.add_argument("--prompt", default="Inbox/Youtube Transcript prompt.md")
     ap.add_argument("--gemini-model", default="gemini-3-pro")
     ap.add_argument("--force-asr", action="store_true")
+    ap.add_argument("--no-cache", action="store_true", help="do not read or write the local cache")
+    ap.add_argument("--refresh-metadata", action="store_true", help="ignore cached metadata and fetch it again")
+    ap.add_argument("--cache-path", default=str(TRANSCRIPT_CACHE_PATH), help="SQLite file for cached transcripts")
+    ap.add_argument("--workers", type=int, default=BATCH_WORKERS, help="videos processed in parallel")
+    ap.add_argument(
+        "--max-asr-seconds",
+        type=int,
+        default=MAX_ASR_SECONDS,
+        help="skip the ASR fallback for videos longer than this (0 = no limit)",
+    )
     args = ap.parse_args()
 
     vault = Path(args.vault).expanduser()
@@ -462,39 +770,23 @@ def main():
     else:
         print(f"WARN: prompt file not found: {prompt_path}")
 
-    meta = get_metadata(args.url)
-    vid = video_id_from_url(args.url)
-    transcript, transcript_source = get_transcript(vid, args.url, force_asr=args.force_asr)
-    chapters = build_chapters(meta)
+    cache = None if args.no_cache else TranscriptCache(args.cache_path)
+    urls = list(dict.fromkeys(args.url))
+    if len(urls) == 1:
+        print(str(process_one(urls[0], args, vault, prompt_text, cache)))
+        return
 
-    try:
-        if prompt_text:
-            note = render_with_gemini(
-                meta,
-                chapters,
-                transcript,
-                args.url,
-                prompt_text,
-                transcript_source,
-                args.gemini_model,
-            )
-        else:
-            note = render(meta, chapters, transcript, args.url, vid, args.prompt)
-    except Exception as e:
-        print(f"WARN: gemini formatting failed, fallback to local renderer: {e}")
-        note = render(meta, chapters, transcript, args.url, vid, args.prompt)
-
-    note = note.rstrip() + (
-        f"\n\n---\ntranscription_method: {transcript_source}\n"
-        f"restructure_model: {args.gemini_model if prompt_text else 'local-renderer'}\n"
-    )
-
-    out_dir = vault / args.out_dir
-    out_dir.mkdir(parents=True, exist_ok=True)
-    fname = sanitize(meta.get("title") or vid)
-    out = out_dir / f"{datetime.now().strftime('%Y-%m-%d')} {fname}.md"
-    out.write_text(note, encoding="utf-8")
-    print(str(out))
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, min(args.workers, len(urls)))) as ex:
+        futures = {ex.submit(process_one, url, args, vault, prompt_text, cache): url for url in urls}
+        for fut in as_completed(futures):
+            try:
+                print(str(fut.result()))
+            except Exception as e:
+                failed += 1
+                print(f"ERROR: {futures[fut]}: {e}", file=sys.stderr)
+    if failed:
+        sys.exit(f"{failed} of {len(urls)} videos failed")
 
 
 if __name__ == "__main__":
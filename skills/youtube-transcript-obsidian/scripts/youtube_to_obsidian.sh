@@ -8,15 +8,20 @@ OUT_DIR="Inbox/YouTube Transcripts"
 PROMPT_REL="Inbox/Youtube Transcript prompt.md"
 GEMINI_MODEL="gemini-3-pro"
 FORCE_ASR=0
+NO_CACHE=0
+REFRESH_METADATA=0
+CACHE_PATH=""
+WORKERS=""
+MAX_ASR_SECONDS=""
 
 usage() {
   cat <<'EOF'
 Usage:
-  youtube_to_obsidian.sh [--vault <vault_path>] [--out-dir <vault_relative_dir>] [--prompt <vault_relative_prompt>] [--gemini-model <model>] [--force-asr] <youtube_url>
+  youtube_to_obsidian.sh [--vault <vault_path>] [--out-dir <vault_relative_dir>] [--prompt <vault_relative_prompt>] [--gemini-model <model>] [--force-asr] [--no-cache] [--refresh-metadata] [--cache-path <sqlite_file>] [--workers <n>] [--max-asr-seconds <n>] <youtube_url> [more_urls...]
 EOF
 }
 
-URL=""
+URLS=()
 while [[ $# -gt 0 ]]; do
   case "$1" in
     --vault)
@@ -29,29 +34,57 @@ while [[ $# -gt 0 ]]; do
       GEMINI_MODEL="${2:-}"; shift 2 ;;
     --force-asr)
       FORCE_ASR=1; shift ;;
+    --no-cache)
+      NO_CACHE=1; shift ;;
+    --refresh-metadata)
+      REFRESH_METADATA=1; shift ;;
+    --cache-path)
+      CACHE_PATH="${2:-}"; shift 2 ;;
+    --workers)
+      WORKERS="${2:-}"; shift 2 ;;
+    --max-asr-seconds)
+      MAX_ASR_SECONDS="${2:-}"; shift 2 ;;
     -h|--help)
       usage; exit 0 ;;
     *)
-      URL="$1"; shift ;;
+      URLS+=("$1"); shift ;;
   esac
 done
 
-if [[ -z "$URL" ]]; then
+if [[ ${#URLS[@]} -eq 0 ]]; then
   usage
   exit 1
 fi
 
-python3 -m pip install --user -q yt-dlp youtube-transcript-api openai-whisper imageio-ffmpeg
+python3 -m pip install --user -q yt-dlp youtube-transcript-api faster-whisper imageio-ffmpeg orjson
 
 CMD=(python3 "$SCRIPT_DIR/youtube_to_obsidian.py" \
-  --url "$URL" \
   --vault "$VAULT" \
   --out-dir "$OUT_DIR" \
   --prompt "$PROMPT_REL" \
   --gemini-model "$GEMINI_MODEL")
 
+for url in "${URLS[@]}"; do
+  CMD+=(--url "$url")
+done
+
 if [[ "$FORCE_ASR" -eq 1 ]]; then
   CMD+=(--force-asr)
 fi
+if [[ "$NO_CACHE" -eq 1 ]]; then
+  CMD+=(--no-cache)
+fi
+if [[ "$REFRESH_METADATA" -eq 1 ]]; then
+  CMD+=(--refresh-metadata)
+fi
+if [[ -n "$CACHE_PATH" ]]; then
+  CMD+=(--cache-path "$CACHE_PATH")
+fi
+if [[ -n "$WORKERS" ]]; then
+  CMD+=(--workers "$WORKERS")
+fi
+if [[ -n "$MAX_ASR_SECONDS" ]]; then
+  CMD+=(--max-asr-seconds "$MAX_ASR_SECONDS")
+fi
 
 "${CMD[@]}"